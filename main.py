@@ -1,199 +1,268 @@
-import json
 import argparse
+import codecs
+import io
+import itertools
 import os
-from collections import Counter
-from urllib.parse import urlparse, urlunparse, unquote
+import string
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+import ijson
+import orjson
 import tiktoken
 import yaml
 import base64
 
+try:
+    from yaml import CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeDumper as YamlDumper
+
 enc = tiktoken.get_encoding("cl100k_base")
 
+STATIC_EXTS = ('.css', '.js', '.png', '.svg', '.jpg', '.jpeg', '.gif', '.woff', '.woff2', '.ttf')
+FILTER_CHUNK_SIZE = 500
+BASE64_CHARS = frozenset(string.ascii_letters + string.digits + '+/=\r\n')
+REQUEST_EXCLUDED_KEYS = frozenset({'bodySize', 'headersSize', 'httpVersion'})
+RESPONSE_EXCLUDED_KEYS = frozenset({'bodySize', 'headersSize', 'statusText', 'httpVersion'})
+STANDARD_HEADERS = frozenset({'host', 'content-length', 'content-type', 'user-agent', 'accept', 'connection'})
 
-def count_tokens(text):
-    tokens = enc.encode(text)
-    return len(tokens)
 
+def count_tokens_batch(texts):
+    tokens = enc.encode_ordinary_batch(texts, num_threads=min(len(texts), os.cpu_count() or 1))
+    return [len(item) for item in tokens]
 
-def load_har_file(file_path):
-    with open(file_path, 'r', encoding='utf-8-sig') as f:
-        return json.load(f)
 
+def iter_entries(file_path):
+    with open(file_path, 'rb') as f:
+        if f.read(len(codecs.BOM_UTF8)) != codecs.BOM_UTF8:
+            f.seek(0)
 
-def remove_query_params(url):
-    parsed_url = urlparse(url)
-    clean_url = urlunparse(parsed_url._replace(query=""))
-    return clean_url
+        yield from ijson.items(f, 'log.entries.item', use_float=True)
 
 
 def parse_multipart(data, boundary):
     boundary_delimiter = f'--{boundary}'
     parts = data.split(boundary_delimiter)
 
-    parts = [part.strip() for part in parts if part.strip() and part.strip() != '--']
+    parts = [part for part in map(str.strip, parts) if part and part != '--']
     parsed_parts = []
 
     for part in parts:
-        key = part.split('\r\n\r\n')[0].split('; name="')[1][:-1]
-
-        if len(part.split('\r\n\r\n')) == 2:
-            value = part.split('\r\n\r\n')[1]
-        else:
-            value = None
+        head, separator, body = part.partition('\r\n\r\n')
+        key = head.split('; name="', 1)[1][:-1]
+        value = body if separator else None
 
         parsed_parts.append({key: value})
 
     return parsed_parts
 
 
-def convert_headers(headers, exclude_standard_headers):
-    standard_headers = ['host', 'content-length', 'content-type', 'user-agent', 'accept', 'connection']
-    return [{header['name']: header['value']} for header in headers if header['name'].lower() != 'cookie' and (
-            not exclude_standard_headers or header['name'].lower() not in standard_headers)]
+def convert_headers(headers, exclude_standard_headers, counter, interned_values):
+    identifiers = []
 
+    for header in headers:
+        name = header['name']
+        lower_name = name.lower()
+
+        if lower_name == 'cookie':
+            continue
+        if exclude_standard_headers and lower_name in STANDARD_HEADERS:
+            continue
+
+        value = header['value']
+        identifiers.append((sys.intern(name), interned_values.setdefault(value, value)))
+
+    counter.update(identifiers)
+    return [{name: value} for name, value in identifiers]
+
+
+def convert_cookies(cookies, counter, interned_values):
+    identifiers = [(sys.intern(cookie['name']), interned_values.setdefault(cookie['value'], cookie['value']))
+                   for cookie in cookies]
+    counter.update(identifiers)
+    return [{name: value} for name, value in identifiers]
 
-def filter_entries(entries, exclude_static=True, exclude_cookies=False, exclude_standard_headers=False):
-    filtered_entries = {}
-    static_values = ['.css', '.js', '.png', '.svg', '.jpg', '.jpeg', '.gif', '.woff', '.woff2', '.ttf']
 
-    for index, entry in enumerate(entries):
+def filter_entries(entries, exclude_static=True, exclude_cookies=False, exclude_standard_headers=False):
+    filtered_entries = []
+    header_counter = Counter()
+    cookie_counter = Counter()
+    interned_values = {}
+    request_excluded_keys = REQUEST_EXCLUDED_KEYS | {'cookies'} if exclude_cookies else REQUEST_EXCLUDED_KEYS
+    response_excluded_keys = RESPONSE_EXCLUDED_KEYS | {'cookies'} if exclude_cookies else RESPONSE_EXCLUDED_KEYS
+
+    for entry in entries:
         request = entry['request']
         response = entry['response']
 
-        if exclude_static:
-            clean_url = remove_query_params(request['url'])
-            if any(clean_url.endswith(ext) for ext in static_values):
-                continue
-
-        filtered_entry = {
-            "request": {k: v for k, v in request.items() if k not in ['bodySize', 'headersSize', 'httpVersion']},
-            "response": {k: v for k, v in response.items() if
-                         k not in ['bodySize', 'headersSize', 'statusText', 'httpVersion']},
-            "comment": entry.get('comment', '')
-        }
+        if exclude_static and request['url'].partition('?')[0].endswith(STATIC_EXTS):
+            continue
 
-        if 'cookies' in request and not exclude_cookies:
-            filtered_entry['request']['cookies'] = [{cookie['name']: cookie['value']} for cookie in request['cookies']]
-        else:
-            del filtered_entry['request']['cookies']
+        filtered_request = {k: v for k, v in request.items() if k not in request_excluded_keys}
+        filtered_response = {k: v for k, v in response.items() if k not in response_excluded_keys}
 
-        if 'cookies' in response and not exclude_cookies:
-            filtered_entry['response']['cookies'] = [{cookie['name']: cookie['value']} for cookie in
-                                                     response['cookies']]
-        else:
-            del filtered_entry['response']['cookies']
+        if 'cookies' in filtered_request:
+            filtered_request['cookies'] = convert_cookies(request['cookies'], cookie_counter, interned_values)
+        if 'cookies' in filtered_response:
+            filtered_response['cookies'] = convert_cookies(response['cookies'], cookie_counter, interned_values)
 
         if 'postData' in request:
             postData = request['postData']
             if 'mimeType' in postData and 'multipart' in postData['mimeType']:
                 boundary_header = [header for header in request['headers'] if header['name'].lower() == 'content-type']
                 boundary = boundary_header[0]['value'].split('boundary=')[1]
-                filtered_entry['request']['postData'] = parse_multipart(postData.get('text', ''), boundary)
+                filtered_request['postData'] = parse_multipart(postData.get('text', ''), boundary)
             else:
                 postData_text = postData.get('text', '')
-                filtered_entry['request']['postData'] = decode_data(postData_text)
+                filtered_request['postData'] = decode_data(postData_text)
 
         if 'queryString' in request:
-            filtered_entry['request']['queryString'] = [{item['name']: unquote(item['value'])} for item in
-                                                        request['queryString']]
+            filtered_request['queryString'] = [
+                {item['name']: unquote(value) if '%' in (value := item['value']) else value}
+                for item in request['queryString']]
 
         if 'headers' in request:
-            filtered_entry['request']['headers'] = convert_headers(request['headers'], exclude_standard_headers)
+            filtered_request['headers'] = convert_headers(request['headers'], exclude_standard_headers, header_counter,
+                                                          interned_values)
         if 'headers' in response:
-            filtered_entry['response']['headers'] = convert_headers(response['headers'], exclude_standard_headers)
+            filtered_response['headers'] = convert_headers(response['headers'], exclude_standard_headers,
+                                                           header_counter, interned_values)
 
         if 'content' in response:
             content = response['content']
             content_text = content.get('text', '')
-            filtered_entry['response']['content'] = decode_data(content_text)
+            filtered_response['content'] = decode_data(content_text)
 
-        filtered_entries[index] = filtered_entry
+        filtered_entries.append({
+            "request": filtered_request,
+            "response": filtered_response,
+            "comment": entry.get('comment', '')
+        })
 
-    return filtered_entries
+    return filtered_entries, header_counter, cookie_counter
 
 
-def create_dict(entries, key, exclude_cookies):
-    counter = Counter()
-    for entry in entries.values():
-        if key == 'cookies' and exclude_cookies:
-            continue
-        items = entry['request'].get(key, []) + entry['response'].get(key, [])
-        for item in items:
-            name = list(item.keys())[0]
-            value = item[name]
-            identifier = (name, value)
-            counter[identifier] += 1
+def iter_chunks(entries, chunk_size):
+    entries = iter(entries)
+    while chunk := list(itertools.islice(entries, chunk_size)):
+        yield chunk
+
+
+def iter_filtered_chunks(chunks, max_workers, exclude_static, exclude_cookies, exclude_standard_headers):
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in chunks:
+            pending.append(executor.submit(filter_entries, chunk, exclude_static, exclude_cookies,
+                                           exclude_standard_headers))
+            if len(pending) > max_workers * 2:
+                yield pending.popleft().result()
 
-    frequent_items = {k: v for k, v in counter.items() if v > 2}
+        while pending:
+            yield pending.popleft().result()
 
+
+def filter_entries_parallel(entries, workers=1, exclude_static=True, exclude_cookies=False,
+                            exclude_standard_headers=False):
+    max_workers = min(workers, os.cpu_count() or 1)
+    if max_workers <= 1:
+        return filter_entries(entries, exclude_static, exclude_cookies, exclude_standard_headers)
+
+    chunks = iter_chunks(entries, FILTER_CHUNK_SIZE)
+    first_chunk = next(chunks, [])
+    second_chunk = next(chunks, None)
+
+    if second_chunk is None:
+        return filter_entries(first_chunk, exclude_static, exclude_cookies, exclude_standard_headers)
+
+    filtered_entries = []
+    header_counter = Counter()
+    cookie_counter = Counter()
+
+    for chunk_entries, chunk_header_counter, chunk_cookie_counter in iter_filtered_chunks(
+            itertools.chain([first_chunk, second_chunk], chunks), max_workers, exclude_static, exclude_cookies,
+            exclude_standard_headers):
+        filtered_entries.extend(chunk_entries)
+        header_counter.update(chunk_header_counter)
+        cookie_counter.update(chunk_cookie_counter)
+
+    return filtered_entries, header_counter, cookie_counter
+
+
+def create_dict(counter):
     dict_link = {}
-    for index, value in enumerate(frequent_items):
-        dict_link[index] = {value[0]: value[1]}
+    identifier_to_index = {}
+    for index, identifier in enumerate(k for k, v in counter.items() if v > 2):
+        name, value = identifier
+        dict_link[index] = {name: value}
+        identifier_to_index[identifier] = index
 
-    return dict_link
+    return dict_link, identifier_to_index
 
 
-def replace_items_with_references(entries, item_dict, key):
-    item_to_index = {json.dumps(v): k for k, v in item_dict.items()}
+def replace_items_with_references(entries, identifier_to_index, key):
+    lookup_reference = identifier_to_index.get
 
-    for entry_key, entry in entries.items():
+    for entry in entries:
         for side in ['request', 'response']:
             items = entry[side].get(key, [])
             new_items = []
             for item in items:
-                item_string = json.dumps({k: v for k, v in item.items()})
-                if item_string in item_to_index:
-                    new_items.append(item_to_index[item_string])
-                else:
-                    new_items.append(item)
+                identifier, = item.items()
+                new_items.append(lookup_reference(identifier, item))
             entry[side][key] = new_items
 
     return entries
 
 
 def minimize_json(data):
-    return json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+def minimize_yaml(data):
+    return yaml.dump(data, Dumper=YamlDumper, allow_unicode=True, sort_keys=True)
 
 
 def save_json_file(data, file_path):
-    with open(file_path, 'w', encoding='utf-8') as f:
+    with open(file_path, 'wb') as f:
         f.write(data)
 
 
 def save_yaml_file(data, file_path):
     with open(file_path, 'w', encoding='utf-8') as f:
-        yaml.dump(data, f, allow_unicode=True, sort_keys=True)
+        f.write(data)
 
 
 def decode_data(data):
-    try:
-        return base64.b64decode(data).decode('utf-8')
-    except (base64.binascii.Error, UnicodeDecodeError, ValueError):
-        return unquote(data)
-
+    if data and BASE64_CHARS.issuperset(data):
+        try:
+            return base64.b64decode(data).decode('utf-8')
+        except (base64.binascii.Error, UnicodeDecodeError, ValueError):
+            pass
 
-def process_har_file(file_path, exclude_static=True, exclude_cookies=False, exclude_standard_headers=False):
-    har_data = load_har_file(file_path)
-    entries = har_data['log']['entries']
+    return unquote(data)
 
-    filtered_entries = filter_entries(entries, exclude_static=exclude_static, exclude_cookies=exclude_cookies,
-                                      exclude_standard_headers=exclude_standard_headers)
 
-    header_dict = create_dict(filtered_entries, 'headers', exclude_cookies=False)
-    cookie_dict = create_dict(filtered_entries, 'cookies', exclude_cookies=exclude_cookies)
+def process_har_file(file_path, exclude_static=True, exclude_cookies=False, exclude_standard_headers=False,
+                     workers=1):
+    entries = iter_entries(file_path)
 
-    minimized_entries = replace_items_with_references(filtered_entries, header_dict, 'headers')
+    filtered_entries, header_counter, cookie_counter = filter_entries_parallel(
+        entries, workers=workers, exclude_static=exclude_static, exclude_cookies=exclude_cookies,
+        exclude_standard_headers=exclude_standard_headers)
 
-    if not exclude_cookies:
-        minimized_entries = replace_items_with_references(minimized_entries, cookie_dict, 'cookies')
+    header_dict, header_to_index = create_dict(header_counter)
+    cookie_dict, cookie_to_index = create_dict(cookie_counter)
 
-    sorted_entries = {}
+    minimized_entries = replace_items_with_references(filtered_entries, header_to_index, 'headers')
 
-    for index, value in enumerate(minimized_entries, 1):
-        sorted_entries[index] = minimized_entries[value]
+    if not exclude_cookies:
+        minimized_entries = replace_items_with_references(minimized_entries, cookie_to_index, 'cookies')
 
     data = {
-        "entries": sorted_entries,
+        "entries": {index: entry for index, entry in enumerate(minimized_entries, 1)},
         "header_dict": header_dict,
     }
     if not exclude_cookies:
@@ -203,16 +272,17 @@ def process_har_file(file_path, exclude_static=True, exclude_cookies=False, excl
 
 
 def get_requests_str_for_prompt(data):
-    http_str = ''
+    http_str = io.StringIO()
+    write = http_str.write
+
     for key, value in data["entries"].items():
+        request = value["request"]
         if "comment" in value:
-            http_str += f'{key}: {value["comment"]} {value["request"]["method"]} {value["request"]["url"]}'
+            write(f'{key}: {value["comment"]} {request["method"]} {request["url"]}{os.linesep}')
         else:
-            http_str += f'{key}: {value["request"]["method"]} {value["request"]["url"]}'
+            write(f'{key}: {request["method"]} {request["url"]}{os.linesep}')
 
-        http_str += os.linesep
-
-    return http_str
+    return http_str.getvalue()
 
 
 def print_prompt(file_name, format_name, http_str):
@@ -276,16 +346,32 @@ def main():
     parser.add_argument('--no-static', action='store_true', help='Exclude static resources')
     parser.add_argument('--no-cookies', action='store_true', help='Exclude cookies')
     parser.add_argument('--no-standard-headers', action='store_true', help='Exclude standard headers')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes for entry filtering (default: 1, filter in-process)')
+    parser.add_argument('--report-both', action='store_true',
+                        help='Report token counts for both JSON and YAML formats')
 
     args = parser.parse_args()
 
     data = process_har_file(args.input, exclude_static=args.no_static, exclude_cookies=args.no_cookies,
-                            exclude_standard_headers=args.no_standard_headers)
+                            exclude_standard_headers=args.no_standard_headers, workers=args.workers)
 
     http_str = get_requests_str_for_prompt(data)
-    token_count_json = count_tokens(minimize_json(data))
-    token_count_yaml = count_tokens(yaml.dump(data, allow_unicode=True))
-    print(f"Total tokens in JSON format: {token_count_json}, in YAML format: {token_count_yaml}")
+
+    serialized_data = {}
+    token_texts = {}
+    if args.format == 'json' or args.report_both:
+        serialized_data['json'] = minimize_json(data)
+        token_texts['JSON'] = serialized_data['json'].decode('utf-8')
+    if args.format == 'yaml' or args.report_both:
+        serialized_data['yaml'] = token_texts['YAML'] = minimize_yaml(data)
+
+    token_counts = count_tokens_batch(list(token_texts.values()))
+    print("Total tokens " + ", ".join(
+        f"in {format_name} format: {token_count}" for format_name, token_count in zip(token_texts, token_counts)))
+
+    output_data = serialized_data[args.format]
+    del data, token_texts, serialized_data
 
     if args.format == 'json':
         if not args.output.endswith('.json'):
@@ -293,10 +379,8 @@ def main():
         else:
             file_name = args.output
 
-        minimized_data = minimize_json(data)
-
         print_prompt(file_name, args.format.upper(), http_str)
-        save_json_file(minimized_data, file_name)
+        save_json_file(output_data, file_name)
     elif args.format == 'yaml':
         if not args.output.endswith('.yaml'):
             file_name = args.output + '.yaml'
@@ -304,7 +388,7 @@ def main():
             file_name = args.output
 
         print_prompt(file_name, args.format.upper(), http_str)
-        save_yaml_file(data, file_name)
+        save_yaml_file(output_data, file_name)
 
 
 if __name__ == '__main__':